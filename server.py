@@ -1,515 +1,899 @@
-import os
-import json
-import csv
-import uuid
-import shutil
-import asyncio
-from pathlib import Path
-from datetime import datetime, timedelta, timezone
-from typing import Optional, List, Tuple
-
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import FileResponse, HTMLResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
-
-# =========================
-# Config / Carga segura
-# =========================
-
-CFG_PATH = Path("C:/qcalt/config.json")
-
-def load_cfg(path: Path) -> dict:
-    if not path.exists():
-        raise FileNotFoundError(f"No se encontró config.json en {path}")
-    with path.open("r", encoding="utf-8") as f:
-        return json.load(f)
-
-CFG = load_cfg(CFG_PATH)
-
-def cfg_get(key, default=None):
-    return CFG.get(key, default)
-
-VIDEO_ROOT  = Path(cfg_get("video_root", "C:/qcalt/videos"))
-EVID_DIR    = Path(cfg_get("evidence_dir", "C:/qcalt/evidencia"))
-TEMP_DIR    = Path(cfg_get("temp_dir", "C:/qcalt/temp"))
-
-FFMPEG      = cfg_get("ffmpeg", "")
-FFPROBE     = cfg_get("ffprobe", "")
-
-SEG_MIN     = int(cfg_get("segment_minutes", 10))
-HLS_SEC     = int(cfg_get("hls_segment_seconds", 4))
-TTL_MIN     = int(cfg_get("ttl_minutes", 30))
-TZ_OFFSET   = cfg_get("timezone_offset", "-06:00")
-MAP_CSV     = Path(cfg_get("machine_map_csv", "C:/qcalt/machine_to_camera.csv"))
-LOG_LEVEL   = cfg_get("log_level", "info")
-SIMULATE    = bool(cfg_get("allow_simulation", True))
-
-DIRECTORY_TEMPLATE = cfg_get("directory_template", "{camera_id}\\{YYYY}\\{MM}\\{DD}")
-FILENAME_PATTERN   = cfg_get("filename_pattern", "{camera_id}_{YYYY}{MM}{DD}_{HH}{mm}{SS}.mp4")
-
-# Carpetas base
-for d in (VIDEO_ROOT, EVID_DIR, TEMP_DIR):
-    d.mkdir(parents=True, exist_ok=True)
-
-# Validación FFmpeg si no simulamos
-if not SIMULATE:
-    missing = []
-    if not (FFMPEG and Path(FFMPEG).exists()):
-        missing.append("ffmpeg")
-    if not (FFPROBE and Path(FFPROBE).exists()):
-        missing.append("ffprobe")
-    if missing:
-        raise RuntimeError(
-            f"Faltan binarios: {', '.join(missing)}. "
-            "Activa 'allow_simulation': true en config.json para arrancar sin FFmpeg o corrige rutas."
-        )
-
-# =========================
-# Utilidades
-# =========================
-
-def segment_anchor(dt: datetime, seg_min: int = SEG_MIN) -> datetime:
-    """Redondea hacia abajo al inicio del segmento (p. ej., cada 10 o 60 min)."""
-    mm = (dt.minute // seg_min) * seg_min
-    return dt.replace(minute=mm, second=0, microsecond=0)
-
-def offset_within_segment(dt: datetime, anchor: datetime) -> int:
-    """Segundos desde el inicio del segmento hasta dt."""
-    return int((dt - anchor).total_seconds())
-
-def parse_iso_ts(ts: str) -> datetime:
-    # Acepta '2025-08-01T13:16:14' y aplica TZ offset
-    try:
-        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Timestamp ISO inválido. Ej: 2025-08-01T13:16:14")
-    # Si no trae tzinfo, asignamos offset del config
-    if dt.tzinfo is None:
-        sign = 1 if TZ_OFFSET.startswith("+") else -1
-        try:
-            hh, mm = TZ_OFFSET[1:].split(":")
-            offset = timezone(sign * timedelta(hours=int(hh), minutes=int(mm)))
-        except Exception:
-            offset = timezone(timedelta(hours=-6))
-        dt = dt.replace(tzinfo=offset)
-    return dt
-
-def load_machine_map(csv_path: Path) -> List[Tuple[str, str, int]]:
-    if not csv_path.exists():
-        return []
-    out = []
-    with csv_path.open("r", encoding="utf-8") as f:
-        rd = csv.DictReader(f)
-        for row in rd:
-            try:
-                out.append((
-                    (row.get("Machine_ID") or "").strip(),
-                    (row.get("camera_id") or "").strip(),
-                    int((row.get("priority") or "1").strip())
-                ))
-            except Exception:
-                continue
-    # Ordena por Machine_ID y priority asc (1 = principal)
-    out.sort(key=lambda r: (r[0], r[2]))
-    return out
-
-MACHINE_MAP = load_machine_map(MAP_CSV)
-
-def camera_for_machine(machine: str) -> Optional[str]:
-    candidates = [c for m,c,p in MACHINE_MAP if m == machine]
-    return candidates[0] if candidates else None
-
-def build_video_path(camera_id: str, dt: datetime) -> Path:
-    """Construye la ruta del archivo usando el INICIO DEL SEGMENTO para el nombre."""
-    dt0 = segment_anchor(dt, SEG_MIN)
-    repl = {
-        "camera_id": camera_id,
-        "YYYY": dt.strftime("%Y"),
-        "MM": dt.strftime("%m"),
-        "DD": dt.strftime("%d"),
-        "HH": dt0.strftime("%H"),
-        "mm": dt0.strftime("%M"),
-        "SS": dt0.strftime("%S"),
-    }
-    dir_rel = DIRECTORY_TEMPLATE.format(**repl)
-    fname = FILENAME_PATTERN.format(**repl)
-    return VIDEO_ROOT / dir_rel / fname
-
-def ensure_dir(p: Path):
-    p.mkdir(parents=True, exist_ok=True)
-
-def cleanup_old_temp(ttl_minutes: int = TTL_MIN):
-    now = datetime.now()
-    for item in TEMP_DIR.glob("*"):
-        try:
-            mtime = datetime.fromtimestamp(item.stat().st_mtime)
-            if now - mtime > timedelta(minutes=ttl_minutes):
-                if item.is_dir():
-                    shutil.rmtree(item, ignore_errors=True)
-                else:
-                    item.unlink(missing_ok=True)
-        except Exception:
-            continue
-
-async def periodic_cleanup():
-    while True:
-        cleanup_old_temp()
-        await asyncio.sleep(60)  # cada minuto
-
-def ffmpeg_cmd_exists() -> bool:
-    return bool(FFMPEG and Path(FFMPEG).exists())
-
-def run_ffmpeg(cmd: List[str]) -> int:
-    from subprocess import run, DEVNULL
-    return run(cmd, stdout=DEVNULL, stderr=DEVNULL).returncode
-
-def calc_anchor_and_offset(dt: datetime) -> tuple[datetime, int]:
-    """Devuelve (segment_start_datetime, offset_seconds)."""
-    anchor = segment_anchor(dt, SEG_MIN)
-    offset = offset_within_segment(dt, anchor)
-    return anchor, offset
-
-# =========================
-# FastAPI app
-# =========================
-
-app = FastAPI(title="QC ALT Video Gateway", version="1.0")
-
-# Servimos el directorio TEMP para HLS (m3u8/ts)
-app.mount("/temp", StaticFiles(directory=str(TEMP_DIR)), name="temp")
-
-@app.on_event("startup")
-async def on_start():
-    # refresca mapa por si lo actualizan antes de reiniciar
-    global MACHINE_MAP
-    MACHINE_MAP = load_machine_map(MAP_CSV)
-    # inicia limpieza periódica
-    asyncio.create_task(periodic_cleanup())
-
-# -------------------------
-# Endpoints de salud / debug
-# -------------------------
-
-@app.get("/health")
-def health():
-    return {
-        "ok": True,
-        "simulate": SIMULATE,
-        "has_ffmpeg": ffmpeg_cmd_exists(),
-        "temp_dir": str(TEMP_DIR),
-        "ttl_minutes": TTL_MIN
-    }
-
-@app.get("/debug/config")
-def debug_config():
-    return {
-        "video_root": str(VIDEO_ROOT),
-        "evidence_dir": str(EVID_DIR),
-        "temp_dir": str(TEMP_DIR),
-        "ffmpeg": FFMPEG,
-        "ffprobe": FFPROBE,
-        "directory_template": DIRECTORY_TEMPLATE,
-        "filename_pattern": FILENAME_PATTERN,
-        "timezone_offset": TZ_OFFSET,
-        "map_csv": str(MAP_CSV),
-        "simulate": SIMULATE
-    }
-
-@app.get("/debug/resolve")
-def debug_resolve(machine: str, ts: str):
-    dt = parse_iso_ts(ts)
-    cam = camera_for_machine(machine)
-    if not cam:
-        raise HTTPException(404, f"No hay cámara para Machine_ID={machine} en el CSV")
-    path = build_video_path(cam, dt)
-    anchor, offset = calc_anchor_and_offset(dt)
-    return {
-        "machine": machine,
-        "camera": cam,
-        "ts": dt.isoformat(),
-        "segment_start": anchor.isoformat(),
-        "offset_seconds": offset,
-        "path": str(path),
-        "exists": path.exists()
-    }
-
-# -------------------------
-# Core: /view (HLS temporal)
-# -------------------------
-
-def gen_hls_from_source(src: Optional[Path], start_s: int, dur_s: int, out_dir: Path) -> tuple[Path, List[Path]]:
-    """
-    Genera HLS (master.m3u8 + segmentos) en out_dir.
-    - Si src es None o no existe y SIMULATE=True, genera señal de prueba.
-    - start_s = offset (segundos dentro del segmento).
-    """
-    ensure_dir(out_dir)
-    m3u8_path = out_dir / "master.m3u8"
-    seg_pat = str(out_dir / "seg_%03d.ts")
-
-    if not SIMULATE and (src is None or not src.exists()):
-        raise HTTPException(404, "Archivo de video no encontrado y simulación desactivada.")
-
-    if SIMULATE and (src is None or not src.exists()):
-        # Señal de prueba (no requiere archivo)
-        if not ffmpeg_cmd_exists():
-            raise HTTPException(500, "FFmpeg requerido incluso en modo simulado para generar HLS.")
-        cmd = [
-            FFMPEG, "-hide_banner", "-loglevel", "error",
-            "-f", "lavfi", "-i", "testsrc=size=1280x720:rate=30",
-            "-f", "lavfi", "-i", "sine=frequency=1000:sample_rate=44100",
-            "-t", str(dur_s),
-            "-map", "0:v:0", "-map", "1:a:0",
-            "-c:v", "libx264", "-preset", "veryfast", "-profile:v", "baseline", "-level", "3.0",
-            "-pix_fmt", "yuv420p",
-            "-c:a", "aac", "-b:a", "128k",
-            "-f", "hls",
-            "-hls_time", str(HLS_SEC),
-            "-hls_playlist_type", "event",
-            "-hls_segment_filename", seg_pat,
-            str(m3u8_path)
-        ]
-        rc = run_ffmpeg(cmd)
-        if rc != 0 or not m3u8_path.exists():
-            raise HTTPException(500, "No se pudo generar HLS simulado.")
-    else:
-        # Fuente real
-        if not ffmpeg_cmd_exists():
-            raise HTTPException(500, "FFmpeg no encontrado (ver config.json).")
-        cmd = [
-            FFMPEG, "-hide_banner", "-loglevel", "error",
-            "-ss", str(start_s), "-i", str(src),
-            "-t", str(dur_s),
-            "-map", "0",
-            "-c:v", "libx264", "-preset", "veryfast", "-profile:v", "baseline", "-level", "3.0",
-            "-pix_fmt", "yuv420p",
-            "-c:a", "aac", "-b:a", "128k",
-            "-f", "hls",
-            "-hls_time", str(HLS_SEC),
-            "-hls_playlist_type", "event",
-            "-hls_segment_filename", seg_pat,
-            str(m3u8_path)
-        ]
-        rc = run_ffmpeg(cmd)
-        if rc != 0 or not m3u8_path.exists():
-            raise HTTPException(500, "FFmpeg no pudo generar HLS del archivo.")
-
-    segs = sorted(out_dir.glob("seg_*.ts"))
-    return m3u8_path, segs
-
-def html_player(hls_url: str, title: str = "QC ALT Player") -> str:
-    return f"""<!doctype html>
-<html lang="es">
-<head>
-<meta charset="utf-8">
-<title>{title}</title>
-<meta name="viewport" content="width=device-width, initial-scale=1">
-<style>
-body {{ margin:0; background:#0b0b0b; color:#fff; font-family:ui-sans-serif,system-ui; }}
-.header {{ padding:10px 14px; background:#111; border-bottom:1px solid #222; }}
-main {{ padding: 10px; }}
-video {{ width: 100%; max-width: 1080px; height: auto; background:#000; outline:none; border:1px solid #222; border-radius:8px; }}
-small {{ color:#aaa; }}
-</style>
-</head>
-<body>
-  <div class="header">
-    <div><b>{title}</b></div>
-    <small>Si no reproduce, intenta abrir en Edge o Safari, o verifica acceso a <code>hls.js</code>.</small>
-  </div>
-  <main>
-    <video id="v" controls autoplay playsinline></video>
-  </main>
-<script>
-(function() {{
-  var video = document.getElementById('v');
-  var src = "{hls_url}";
-  function native() {{
-    if (video.canPlayType('application/vnd.apple.mpegurl')) {{
-      video.src = src;
-      video.play().catch(()=>{{}});
-      return true;
-    }}
-    return false;
-  }}
-  if (!native()) {{
-    var s = document.createElement('script');
-    s.src = 'https://cdn.jsdelivr.net/npm/hls.js@latest';
-    s.onload = function() {{
-      if (window.Hls) {{
-        var hls = new Hls({{lowLatencyMode:false}});
-        hls.loadSource(src);
-        hls.attachMedia(video);
-        hls.on(Hls.Events.MANIFEST_PARSED, function() {{
-          video.play().catch(()=>{{}});
-        }});
-      }}
-    }};
-    document.head.appendChild(s);
-  }}
-}})();
-</script>
-</body>
-</html>
-"""
-
-@app.get("/view", response_class=HTMLResponse)
-def view(
-    machine: str = Query(..., description="Machine_ID"),
-    ts: str = Query(..., description="Timestamp ISO, ej. 2025-08-01T13:16:14"),
-    dur: int = Query(30, ge=5, le=600, description="Duración en segundos (5-600)")
-):
-    dt = parse_iso_ts(ts)
-    cam = camera_for_machine(machine)
-    if not cam:
-        raise HTTPException(404, f"No hay cámara mapeada para Machine_ID={machine}")
-
-    src = build_video_path(cam, dt)
-    anchor, start_s = calc_anchor_and_offset(dt)
-
-    session_id = f"{machine}_{dt.strftime('%Y%m%dT%H%M%S')}_{uuid.uuid4().hex[:8]}"
-    out_dir = TEMP_DIR / "hls" / session_id
-    ensure_dir(out_dir)
-
-    m3u8, _ = gen_hls_from_source(src if src.exists() else None, start_s, dur, out_dir)
-
-    rel = m3u8.relative_to(TEMP_DIR).as_posix()  # e.g. hls/abc/master.m3u8
-    hls_url = f"/temp/{rel}"
-    title = f"QC ALT — {machine} @ {dt.strftime('%Y-%m-%d %H:%M:%S')}"
-    return HTMLResponse(content=html_player(hls_url, title=title))
-
-# -------------------------
-# Snapshot (preview) y export
-# -------------------------
-
-def gen_snapshot(src: Optional[Path], at_s: int, out_path: Path):
-    ensure_dir(out_path.parent)
-    if SIMULATE and (src is None or not src.exists()):
-        if not ffmpeg_cmd_exists():
-            raise HTTPException(500, "Se requiere FFmpeg para generar snapshot simulado.")
-        cmd = [
-            FFMPEG, "-hide_banner", "-loglevel", "error",
-            "-f", "lavfi", "-i", "testsrc=size=1280x720:rate=1",
-            "-frames:v", "1", str(out_path)
-        ]
-        rc = run_ffmpeg(cmd)
-        if rc != 0 or not out_path.exists():
-            raise HTTPException(500, "No se pudo generar snapshot simulado.")
-        return
-
-    if not ffmpeg_cmd_exists():
-        raise HTTPException(500, "FFmpeg no encontrado (ver config.json).")
-    if src is None or not src.exists():
-        raise HTTPException(404, "Archivo de video no encontrado.")
-
-    cmd = [
-        FFMPEG, "-hide_banner", "-loglevel", "error",
-        "-ss", str(at_s), "-i", str(src),
-        "-frames:v", "1",
-        "-q:v", "2",
-        str(out_path)
-    ]
-    rc = run_ffmpeg(cmd)
-    if rc != 0 or not out_path.exists():
-        raise HTTPException(500, "FFmpeg no pudo generar snapshot.")
-
-@app.get("/snapshot")
-def snapshot(machine: str, ts: str):
-    dt = parse_iso_ts(ts)
-    cam = camera_for_machine(machine)
-    if not cam:
-        raise HTTPException(404, f"No hay cámara para Machine_ID={machine}")
-    src = build_video_path(cam, dt)
-    anchor, at_s = calc_anchor_and_offset(dt)
-
-    out = TEMP_DIR / "snap" / f"{machine}_{dt.strftime('%Y%m%dT%H%M%S')}.jpg"
-    gen_snapshot(src if src.exists() else None, at_s, out)
-    return FileResponse(str(out), media_type="image/jpeg", filename=out.name)
-
-@app.get("/export/snapshot")
-def export_snapshot(machine: str, ts: str):
-    dt = parse_iso_ts(ts)
-    cam = camera_for_machine(machine)
-    if not cam:
-        raise HTTPException(404, f"No hay cámara para Machine_ID={machine}")
-    src = build_video_path(cam, dt)
-    anchor, at_s = calc_anchor_and_offset(dt)
-    out = EVID_DIR / "snapshots" / f"{machine}_{dt.strftime('%Y%m%dT%H%M%S')}.jpg"
-    gen_snapshot(src if src.exists() else None, at_s, out)
-    return JSONResponse({"ok": True, "file": str(out)})
-
-def export_clip_ffmpeg(src: Optional[Path], start_s: int, dur_s: int, out_path: Path):
-    ensure_dir(out_path.parent)
-    if SIMULATE and (src is None or not src.exists()):
-        if not ffmpeg_cmd_exists():
-            raise HTTPException(500, "Se requiere FFmpeg para exportar clip simulado.")
-        cmd = [
-            FFMPEG, "-hide_banner", "-loglevel", "error",
-            "-f", "lavfi", "-i", "testsrc=size=1280x720:rate=30",
-            "-f", "lavfi", "-i", "sine=frequency=1000:sample_rate=44100",
-            "-t", str(dur_s),
-            "-map", "0:v:0", "-map", "1:a:0",
-            "-c:v", "libx264", "-preset", "veryfast", "-profile:v", "baseline", "-level", "3.0",
-            "-pix_fmt", "yuv420p",
-            "-c:a", "aac", "-b:a", "128k",
-            str(out_path)
-        ]
-        rc = run_ffmpeg(cmd)
-        if rc != 0 or not out_path.exists():
-            raise HTTPException(500, "No se pudo exportar clip simulado.")
-        return
-
-    if not ffmpeg_cmd_exists():
-        raise HTTPException(500, "FFmpeg no encontrado (ver config.json).")
-    if src is None or not src.exists():
-        raise HTTPException(404, "Archivo de video no encontrado.")
-
-    cmd = [
-        FFMPEG, "-hide_banner", "-loglevel", "error",
-        "-ss", str(start_s), "-i", str(src),
-        "-t", str(dur_s),
-        "-map", "0",
-        "-c:v", "libx264", "-preset", "veryfast", "-profile:v", "baseline", "-level", "3.0",
-        "-pix_fmt", "yuv420p",
-        "-c:a", "aac", "-b:a", "128k",
-        str(out_path)
-    ]
-    rc = run_ffmpeg(cmd)
-    if rc != 0 or not out_path.exists():
-        raise HTTPException(500, "FFmpeg no pudo exportar el clip.")
-
-@app.get("/export/clip")
-def export_clip(machine: str, ts: str, dur: int = 30):
-    dt = parse_iso_ts(ts)
-    cam = camera_for_machine(machine)
-    if not cam:
-        raise HTTPException(404, f"No hay cámara para Machine_ID={machine}")
-    src = build_video_path(cam, dt)
-    anchor, start_s = calc_anchor_and_offset(dt)
-
-    out = EVID_DIR / "clips" / f"{machine}_{dt.strftime('%Y%m%dT%H%M%S')}_{dur}s.mp4"
-    export_clip_ffmpeg(src if src.exists() else None, start_s, dur, out)
-    return JSONResponse({"ok": True, "file": str(out)})
-
-# -------------------------
-# Página raíz simple
-# -------------------------
-
-@app.get("/", response_class=HTMLResponse)
-def home():
-    return """<!doctype html>
-<html lang="es"><meta charset="utf-8">
-<title>QC ALT</title>
-<body style="font-family:ui-sans-serif; padding:20px">
-<h2>QC ALT — Gateway de Video</h2>
-<ul>
-  <li><a href="/docs">/docs</a> (Swagger)</li>
-  <li><a href="/health">/health</a></li>
-  <li>Ejemplo /view: <code>/view?machine=P703_L1&ts=2025-08-01T13:16:14&dur=30</code></li>
-  <li>Ejemplo /snapshot: <code>/snapshot?machine=P703_L1&ts=2025-08-01T13:16:14</code></li>
-  <li>Ejemplo /export/clip: <code>/export/clip?machine=P703_L1&ts=2025-08-01T13:16:14&dur=30</code></li>
-</ul>
-</body></html>"""
-# =========================
-# Fin del archivo
-# =========================
+import os
+import csv
+import html
+import json
+import time
+import shutil
+import string
+import asyncio
+import hashlib
+import logging
+import functools
+import threading
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
+from typing import Optional, List, Tuple
+
+from fastapi import FastAPI, Header, HTTPException, Query, Response
+from fastapi.responses import FileResponse, HTMLResponse, ORJSONResponse
+from fastapi.staticfiles import StaticFiles
+
+try:
+    import watchfiles
+except ImportError:  # opcional: sin watchfiles los cambios se toman al reiniciar
+    watchfiles = None
+
+# =========================
+# Config / Carga segura
+# =========================
+
+CFG_PATH = Path("C:/qcalt/config.json")
+
+def load_cfg(path: Path) -> dict:
+    if not path.exists():
+        raise FileNotFoundError(f"No se encontró config.json en {path}")
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+CFG = load_cfg(CFG_PATH)
+
+def cfg_get(key, default=None):
+    return CFG.get(key, default)
+
+VIDEO_ROOT  = Path(cfg_get("video_root", "C:/qcalt/videos"))
+EVID_DIR    = Path(cfg_get("evidence_dir", "C:/qcalt/evidencia"))
+TEMP_DIR    = Path(cfg_get("temp_dir", "C:/qcalt/temp"))
+
+FFMPEG      = cfg_get("ffmpeg", "")
+FFPROBE     = cfg_get("ffprobe", "")
+
+SEG_MIN     = int(cfg_get("segment_minutes", 10))
+HLS_SEC     = int(cfg_get("hls_segment_seconds", 4))
+TTL_MIN     = int(cfg_get("ttl_minutes", 30))
+MAX_TEMP_MB = int(cfg_get("max_temp_mb", 2048))  # tope duro del temp; 0 = sin límite
+TZ_OFFSET   = cfg_get("timezone_offset", "-06:00")
+MAP_CSV     = Path(cfg_get("machine_map_csv", "C:/qcalt/machine_to_camera.csv"))
+LOG_LEVEL   = cfg_get("log_level", "info")
+SIMULATE    = bool(cfg_get("allow_simulation", True))
+
+DIRECTORY_TEMPLATE = cfg_get("directory_template", "{camera_id}\\{YYYY}\\{MM}\\{DD}")
+FILENAME_PATTERN   = cfg_get("filename_pattern", "{camera_id}_{YYYY}{MM}{DD}_{HH}{mm}{SS}.mp4")
+
+log = logging.getLogger("qcalt")
+
+# Carpetas base
+for d in (VIDEO_ROOT, EVID_DIR, TEMP_DIR):
+    d.mkdir(parents=True, exist_ok=True)
+
+async def _validate_binaries():
+    """Valida FFmpeg/ffprobe en background: el server levanta (y responde
+    /health) sin esperar stats a rutas posiblemente de red."""
+    missing = []
+    if not (FFMPEG and Path(FFMPEG).exists()):
+        missing.append("ffmpeg")
+    if not (FFPROBE and Path(FFPROBE).exists()):
+        missing.append("ffprobe")
+    if missing:
+        msg = (
+            f"Faltan binarios: {', '.join(missing)}. "
+            "Activa 'allow_simulation': true en config.json para arrancar sin FFmpeg o corrige rutas."
+        )
+        if SIMULATE:
+            log.warning(msg)
+        else:
+            log.error(msg)
+
+# =========================
+# Utilidades
+# =========================
+
+def calc_anchor_and_offset(dt: datetime, seg_min: int = SEG_MIN) -> tuple[datetime, int]:
+    """Devuelve (segment_start_datetime, offset_seconds).
+
+    Aritmética entera sobre minuto/segundo: nada de timedelta intermedio,
+    y un solo datetime nuevo (el anchor)."""
+    mm = (dt.minute // seg_min) * seg_min
+    offset = (dt.minute - mm) * 60 + dt.second
+    anchor = dt.replace(minute=mm, second=0, microsecond=0)
+    return anchor, offset
+
+def _default_tz() -> timezone:
+    sign = 1 if TZ_OFFSET.startswith("+") else -1
+    try:
+        hh, mm = TZ_OFFSET[1:].split(":")
+        return timezone(sign * timedelta(hours=int(hh), minutes=int(mm)))
+    except Exception:
+        return timezone(timedelta(hours=-6))
+
+# tzinfo del config, construido una sola vez al importar
+_DEFAULT_TZ = _default_tz()
+
+# Tabla de 2 dígitos precalculada: formatear timestamps compactos sin pagar
+# el parseo del format spec de strftime en cada llamada.
+_D2 = tuple("%02d" % i for i in range(100))
+
+def format_compact(dt: datetime) -> str:
+    """'YYYYMMDDTHHMMSS' para session ids y nombres de archivo."""
+    return f"{dt.year}{_D2[dt.month]}{_D2[dt.day]}T{_D2[dt.hour]}{_D2[dt.minute]}{_D2[dt.second]}"
+
+def parse_iso_ts(ts: str) -> datetime:
+    # Acepta '2025-08-01T13:16:14' y aplica TZ offset
+    # Fast path: el formato canónico 'YYYY-MM-DDTHH:MM:SS' (el que mandan los
+    # dashboards) se arma directo sin pasar por fromisoformat ni crear tzinfo.
+    # isascii + isdecimal por campo: int() tolera espacios, signos y dígitos
+    # no-ASCII que fromisoformat rechaza, aquí deben ser 400 igual.
+    if (len(ts) == 19 and ts.isascii()
+            and ts[4] == "-" and ts[7] == "-" and ts[10] in ("T", " ")
+            and ts[13] == ":" and ts[16] == ":"
+            and ts[0:4].isdecimal() and ts[5:7].isdecimal() and ts[8:10].isdecimal()
+            and ts[11:13].isdecimal() and ts[14:16].isdecimal() and ts[17:19].isdecimal()):
+        try:
+            return datetime(
+                int(ts[0:4]), int(ts[5:7]), int(ts[8:10]),
+                int(ts[11:13]), int(ts[14:16]), int(ts[17:19]),
+                tzinfo=_DEFAULT_TZ,
+            )
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Timestamp ISO inválido. Ej: 2025-08-01T13:16:14")
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Timestamp ISO inválido. Ej: 2025-08-01T13:16:14")
+    # Si no trae tzinfo, asignamos offset del config
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=_DEFAULT_TZ)
+    return dt
+
+def load_machine_map(csv_path: Path) -> List[Tuple[str, str, int]]:
+    if not csv_path.exists():
+        return []
+    out = []
+    with csv_path.open("r", encoding="utf-8", newline="") as f:
+        rd = csv.reader(f)
+        # Resuelve columnas una vez desde el header; evita el dict por fila
+        # que construye DictReader.
+        try:
+            header = next(rd)
+            i_m = header.index("Machine_ID")
+            i_c = header.index("camera_id")
+            i_p = header.index("priority")
+        except (StopIteration, ValueError):
+            return []
+        for row in rd:
+            try:
+                out.append((
+                    row[i_m].strip(),
+                    row[i_c].strip(),
+                    int(row[i_p].strip() or "1")
+                ))
+            except (IndexError, ValueError):
+                continue
+    # Ordena por Machine_ID y priority asc (1 = principal)
+    out.sort(key=lambda r: (r[0], r[2]))
+    return out
+
+def build_machine_index(machine_map: List[Tuple[str, str, int]]) -> dict:
+    """Indexa el mapa ordenado: primera entrada por máquina = cámara principal."""
+    index = {}
+    for m, c, p in machine_map:
+        index.setdefault(m, c)
+    return index
+
+# Carga perezosa: el CSV se lee en el primer request que lo necesite, no en
+# el import ni en el startup (el server acepta tráfico antes).
+MACHINE_MAP: Optional[List[Tuple[str, str, int]]] = None
+MACHINE_INDEX: Optional[dict] = None
+_MAP_CSV_MTIME = 0.0
+_MAP_LOCK = threading.Lock()
+
+def _ensure_machine_index() -> dict:
+    global MACHINE_MAP, MACHINE_INDEX, _MAP_CSV_MTIME
+    if MACHINE_INDEX is None:
+        with _MAP_LOCK:
+            if MACHINE_INDEX is None:
+                MACHINE_MAP = load_machine_map(MAP_CSV)
+                MACHINE_INDEX = build_machine_index(MACHINE_MAP)
+                try:
+                    _MAP_CSV_MTIME = MAP_CSV.stat().st_mtime
+                except OSError:
+                    _MAP_CSV_MTIME = 0.0
+    return MACHINE_INDEX
+
+def reload_machine_map_if_changed():
+    """Relee el CSV solo si su mtime cambió desde la última carga."""
+    global MACHINE_MAP, MACHINE_INDEX, _MAP_CSV_MTIME
+    if MACHINE_INDEX is None:
+        _ensure_machine_index()
+        return
+    try:
+        mtime = MAP_CSV.stat().st_mtime
+    except OSError:
+        return
+    if mtime == _MAP_CSV_MTIME:
+        return
+    with _MAP_LOCK:
+        MACHINE_MAP = load_machine_map(MAP_CSV)
+        MACHINE_INDEX = build_machine_index(MACHINE_MAP)
+        _MAP_CSV_MTIME = mtime
+
+def camera_for_machine(machine: str) -> Optional[str]:
+    return _ensure_machine_index().get(machine)
+
+_TEMPLATE_FIELDS = ("camera_id", "YYYY", "MM", "DD", "HH", "mm", "SS")
+
+def _compile_path_template(tmpl: str):
+    """Precompila un template '{campo}...' a una función posicional, para no
+    re-parsear el format string ni armar un dict en cada request."""
+    parts = []  # (literal, índice en _TEMPLATE_FIELDS o None)
+    for literal, field, _spec, _conv in string.Formatter().parse(tmpl):
+        if field and field not in _TEMPLATE_FIELDS:
+            raise ValueError(
+                f"Placeholder desconocido {{{field}}} en el template {tmpl!r} "
+                f"(config.json). Válidos: {', '.join(_TEMPLATE_FIELDS)}"
+            )
+        parts.append((literal, _TEMPLATE_FIELDS.index(field) if field else None))
+    def fn(args: tuple) -> str:
+        out = []
+        for literal, idx in parts:
+            out.append(literal)
+            if idx is not None:
+                out.append(args[idx])
+        return "".join(out)
+    return fn
+
+_DIR_FN   = _compile_path_template(DIRECTORY_TEMPLATE)
+_FNAME_FN = _compile_path_template(FILENAME_PATTERN)
+
+def build_video_path(camera_id: str, dt: datetime) -> Path:
+    """Construye la ruta del archivo usando el INICIO DEL SEGMENTO para el nombre."""
+    # Anchor inline: solo cambia el minuto (segundos a 00), así que no hace
+    # falta materializar otro datetime ni llamar strftime.
+    mm = (dt.minute // SEG_MIN) * SEG_MIN
+    args = (camera_id, str(dt.year), _D2[dt.month], _D2[dt.day],
+            _D2[dt.hour], _D2[mm], "00")
+    return VIDEO_ROOT / _DIR_FN(args) / _FNAME_FN(args)
+
+def ensure_dir(p: Path):
+    p.mkdir(parents=True, exist_ok=True)
+
+@functools.lru_cache(maxsize=4096)
+def _path_exists_cached(p: str, bucket: int) -> bool:
+    return Path(p).exists()
+
+def path_exists(p: Path) -> bool:
+    """exists() con caché corta (~30 s) para rutas consultadas repetidamente."""
+    return _path_exists_cached(str(p), int(time.time() // 30))
+
+@functools.lru_cache(maxsize=512)
+def _dir_index(dir_path: str, bucket: int) -> frozenset:
+    try:
+        return frozenset(e.name for e in os.scandir(dir_path))
+    except OSError:
+        return frozenset()
+
+def segment_exists(p: Path) -> bool:
+    """Existencia vía listado del directorio padre: un solo scandir responde por
+    todos los segmentos de esa cámara/día. La clave por minuto hace que los
+    segmentos nuevos aparezcan en ~60 s sin invalidar a mano."""
+    return p.name in _dir_index(str(p.parent), int(time.time() // 60))
+
+# Sesiones HLS vivas: session_id -> [último acceso, bytes en disco o None].
+# LRU real (move_to_end en cada hit) en vez de confiar solo en el mtime, y
+# tamaños cacheados para no re-caminar cada carpeta en cada ciclo.
+MAX_TEMP_BYTES = MAX_TEMP_MB * 1024 * 1024
+ACTIVE_SESSIONS: "OrderedDict[str, list]" = OrderedDict()
+_SESS_LOCK = threading.Lock()
+
+def touch_session(session_id: str):
+    """Marca la sesión como recién usada (también en cache hits)."""
+    with _SESS_LOCK:
+        rec = ACTIVE_SESSIONS.get(session_id)
+        if rec is None:
+            # [último acceso, bytes medidos, mtime del dir al medir]
+            ACTIVE_SESSIONS[session_id] = [time.time(), None, 0.0]
+        else:
+            rec[0] = time.time()
+            ACTIVE_SESSIONS.move_to_end(session_id)
+
+def _drop_session(session_id: str):
+    with _SESS_LOCK:
+        ACTIVE_SESSIONS.pop(session_id, None)
+
+def _set_session_size(session_id: str, size: int, dir_mtime: float):
+    with _SESS_LOCK:
+        rec = ACTIVE_SESSIONS.get(session_id)
+        if rec is not None:
+            rec[1] = size
+            rec[2] = dir_mtime
+
+def _dir_size(path: str) -> int:
+    total = 0
+    try:
+        with os.scandir(path) as it:
+            for e in it:
+                try:
+                    total += e.stat().st_size
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return total
+
+def cleanup_old_temp(ttl_minutes: int = TTL_MIN):
+    now = time.time()
+    limit = now - ttl_minutes * 60
+
+    # 1) Sesiones HLS: expira por último ACCESO (no mtime), así una sesión
+    #    que sigue reproduciéndose no se borra a mitad de playback. Para
+    #    carpetas sin registro (p. ej. tras un reinicio) cae al mtime.
+    try:
+        with os.scandir(TEMP_DIR / "hls") as it:
+            session_dirs = list(it)
+    except OSError:
+        session_dirs = []
+    with _SESS_LOCK:
+        known = {sid: tuple(rec) for sid, rec in ACTIVE_SESSIONS.items()}
+    # Registros cuyo directorio ya no existe (borrado fuera de este ciclo)
+    on_disk = {e.name for e in session_dirs}
+    for sid in known:
+        if sid not in on_disk:
+            _drop_session(sid)
+    alive = []
+    for entry in session_dirs:
+        rec = known.get(entry.name)
+        try:
+            last = rec[0] if rec else entry.stat().st_mtime
+        except OSError:
+            continue
+        if last < limit:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            _drop_session(entry.name)
+        else:
+            alive.append(entry)
+
+    # 2) Tope duro de bytes: si el temp excede MAX_TEMP_BYTES, expulsa
+    #    sesiones LRU-first hasta volver bajo el límite.
+    if MAX_TEMP_BYTES > 0 and alive:
+        sizes = {}
+        for entry in alive:
+            rec = known.get(entry.name)
+            try:
+                dir_mtime = entry.stat().st_mtime
+            except OSError:
+                dir_mtime = 0.0
+            # El tamaño cacheado solo vale si el directorio no cambió desde la
+            # medición (FFmpeg pudo seguir escribiendo segmentos).
+            if rec is not None and rec[1] is not None and rec[2] >= dir_mtime:
+                sizes[entry.name] = rec[1]
+            else:
+                sizes[entry.name] = _dir_size(entry.path)
+                _set_session_size(entry.name, sizes[entry.name], dir_mtime)
+        total = sum(sizes.values())
+        if total > MAX_TEMP_BYTES:
+            alive.sort(key=lambda e: known[e.name][0] if e.name in known else 0.0)
+            for entry in alive:
+                if total <= MAX_TEMP_BYTES:
+                    break
+                shutil.rmtree(entry.path, ignore_errors=True)
+                total -= sizes.get(entry.name, 0)
+                _drop_session(entry.name)
+
+    # 3) Resto del temp (snapshots, archivos sueltos): TTL por mtime como antes;
+    #    scandir trae el mtime junto con el nombre (en Windows sin stat extra).
+    try:
+        with os.scandir(TEMP_DIR) as it:
+            entries = [e for e in it if e.name != "hls"]
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime > limit:
+                continue
+            if entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.unlink(entry.path)
+        except OSError:
+            continue
+
+async def periodic_cleanup():
+    while True:
+        # en un thread: con miles de entradas en TEMP no hay que frenar el loop
+        await asyncio.to_thread(cleanup_old_temp)
+        await asyncio.sleep(60)  # cada minuto
+
+# FFMPEG es config y no cambia en runtime: un solo stat al importar en vez
+# de uno por cada invocación en el hot path.
+HAS_FFMPEG: bool = bool(FFMPEG and Path(FFMPEG).exists())
+
+def ffmpeg_cmd_exists() -> bool:
+    return HAS_FFMPEG
+
+# Pool de workers FFmpeg: N tareas fijas consumen una cola FIFO de trabajos.
+# Igual que el semáforo que reemplaza, acota la concurrencia a los núcleos,
+# pero además atiende ráfagas en orden de llegada (nadie se cuela) y evita
+# apilar una tarea bloqueada por request esperando el semáforo.
+_FFMPEG_WORKERS = os.cpu_count() or 2
+_FFMPEG_QUEUE: Optional[asyncio.Queue] = None
+# Referencias fuertes a los workers: el loop solo guarda weakrefs a las
+# tasks, sin esto el GC podría matarlas a media operación.
+_FFMPEG_TASKS: List[asyncio.Task] = []
+
+async def _ffmpeg_worker(queue: asyncio.Queue):
+    while True:
+        cmd, fut = await queue.get()
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            rc = await proc.wait()
+            if not fut.cancelled():
+                fut.set_result(rc)
+        except Exception as exc:
+            if not fut.cancelled():
+                fut.set_exception(exc)
+        finally:
+            queue.task_done()
+
+def _ensure_ffmpeg_pool() -> asyncio.Queue:
+    global _FFMPEG_QUEUE
+    if _FFMPEG_QUEUE is None:
+        _FFMPEG_QUEUE = asyncio.Queue()
+        for _ in range(_FFMPEG_WORKERS):
+            _FFMPEG_TASKS.append(asyncio.create_task(_ffmpeg_worker(_FFMPEG_QUEUE)))
+    return _FFMPEG_QUEUE
+
+async def run_ffmpeg(cmd: List[str]) -> int:
+    queue = _ensure_ffmpeg_pool()
+    fut = asyncio.get_running_loop().create_future()
+    await queue.put((cmd, fut))
+    return await fut
+
+# =========================
+# FastAPI app
+# =========================
+
+# orjson (vía ORJSONResponse) serializa en C; los endpoints JSON los pegan
+# seguido los probes de monitoreo y el dashboard.
+app = FastAPI(title="QC ALT Video Gateway", version="1.0",
+              default_response_class=ORJSONResponse)
+
+# Servimos el directorio TEMP para HLS (m3u8/ts)
+app.mount("/temp", StaticFiles(directory=str(TEMP_DIR)), name="temp")
+
+async def _config_watcher():
+    """Suscripción a nivel kernel (inotify/ReadDirectoryChangesW vía
+    watchfiles): el mapa se recarga cuando el CSV cambia de verdad, sin
+    polling ni reinicios."""
+    # awatch truena con FileNotFoundError sobre rutas inexistentes; el CSV
+    # puede no existir (load_machine_map lo tolera), así que solo se observan
+    # las rutas presentes. CFG_PATH siempre existe (load_cfg ya lo validó).
+    paths = [str(CFG_PATH)]
+    if MAP_CSV.exists():
+        paths.append(str(MAP_CSV))
+    else:
+        log.warning("%s no existe; no se observará hasta reiniciar", MAP_CSV)
+    try:
+        async for changes in watchfiles.awatch(*paths):
+            for _change, p in changes:
+                if p.endswith(MAP_CSV.name):
+                    log.info("machine_to_camera.csv cambió; recargando mapa")
+                    reload_machine_map_if_changed()
+                elif p.endswith(CFG_PATH.name):
+                    log.warning("config.json cambió; la mayoría de los valores requieren reiniciar el servicio")
+    except OSError as exc:
+        log.warning("watcher de config detenido: %s", exc)
+
+@app.on_event("startup")
+async def on_start():
+    # valida binarios en background: no bloquea el bind del puerto
+    asyncio.create_task(_validate_binaries())
+    # inicia limpieza periódica
+    asyncio.create_task(periodic_cleanup())
+    # observa config/CSV si watchfiles está instalado
+    if watchfiles is not None:
+        asyncio.create_task(_config_watcher())
+    else:
+        log.info("watchfiles no instalado; el mapa solo se recarga al reiniciar")
+
+# -------------------------
+# Endpoints de salud / debug
+# -------------------------
+
+@app.get("/health")
+def health():
+    return {
+        "ok": True,
+        "simulate": SIMULATE,
+        "has_ffmpeg": ffmpeg_cmd_exists(),
+        "temp_dir": str(TEMP_DIR),
+        "ttl_minutes": TTL_MIN
+    }
+
+@app.get("/debug/config")
+def debug_config():
+    return {
+        "video_root": str(VIDEO_ROOT),
+        "evidence_dir": str(EVID_DIR),
+        "temp_dir": str(TEMP_DIR),
+        "ffmpeg": FFMPEG,
+        "ffprobe": FFPROBE,
+        "directory_template": DIRECTORY_TEMPLATE,
+        "filename_pattern": FILENAME_PATTERN,
+        "timezone_offset": TZ_OFFSET,
+        "map_csv": str(MAP_CSV),
+        "simulate": SIMULATE
+    }
+
+@app.get("/debug/resolve")
+def debug_resolve(machine: str, ts: str):
+    dt = parse_iso_ts(ts)
+    cam = camera_for_machine(machine)
+    if not cam:
+        raise HTTPException(404, f"No hay cámara para Machine_ID={machine} en el CSV")
+    path = build_video_path(cam, dt)
+    anchor, offset = calc_anchor_and_offset(dt)
+    return {
+        "machine": machine,
+        "camera": cam,
+        "ts": dt.isoformat(),
+        "segment_start": anchor.isoformat(),
+        "offset_seconds": offset,
+        "path": str(path),
+        "exists": path_exists(path)
+    }
+
+# -------------------------
+# Core: /view (HLS temporal)
+# -------------------------
+
+# Locks por sesión para serializar misses concurrentes del mismo session_id;
+# se descartan al liberar (el dict no crece con sesiones viejas).
+_HLS_LOCKS: dict = {}
+
+async def gen_hls_from_source(src: Optional[Path], start_s: int, dur_s: int, out_dir: Path, accurate: bool = False) -> Path:
+    """
+    Genera HLS (master.m3u8 + segmentos) en out_dir.
+    - src es None si el archivo no existe (el caller ya hizo el stat).
+    - Si src es None y SIMULATE=True, genera señal de prueba.
+    - start_s = offset (segundos dentro del segmento).
+    - accurate=True fuerza re-encode (corte exacto a mitad de GOP); por
+      defecto se remuxea con -c copy, que es casi gratis en CPU.
+    """
+    ensure_dir(out_dir)
+    m3u8_path = out_dir / "master.m3u8"
+    seg_pat = str(out_dir / "seg_%03d.ts")
+
+    if not SIMULATE and src is None:
+        raise HTTPException(404, "Archivo de video no encontrado y simulación desactivada.")
+
+    if SIMULATE and src is None:
+        # Señal de prueba (no requiere archivo)
+        if not HAS_FFMPEG:
+            raise HTTPException(500, "FFmpeg requerido incluso en modo simulado para generar HLS.")
+        cmd = [
+            FFMPEG, "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", "testsrc=size=1280x720:rate=30",
+            "-f", "lavfi", "-i", "sine=frequency=1000:sample_rate=44100",
+            "-t", str(dur_s),
+            "-map", "0:v:0", "-map", "1:a:0",
+            "-c:v", "libx264", "-preset", "veryfast", "-profile:v", "baseline", "-level", "3.0",
+            "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-b:a", "128k",
+            "-f", "hls",
+            "-hls_time", str(HLS_SEC),
+            "-hls_playlist_type", "event",
+            "-hls_segment_filename", seg_pat,
+            str(m3u8_path)
+        ]
+        rc = await run_ffmpeg(cmd)
+        if rc != 0 or not m3u8_path.exists():
+            # El playlist 'event' se escribe incremental: no dejar un master
+            # parcial que el cache de sesiones tome como hit.
+            shutil.rmtree(out_dir, ignore_errors=True)
+            raise HTTPException(500, "No se pudo generar HLS simulado.")
+    else:
+        # Fuente real
+        if not HAS_FFMPEG:
+            raise HTTPException(500, "FFmpeg no encontrado (ver config.json).")
+        if accurate:
+            # Re-encode: corte exacto aunque caiga a mitad de GOP
+            codec = [
+                "-c:v", "libx264", "-preset", "veryfast", "-profile:v", "baseline", "-level", "3.0",
+                "-pix_fmt", "yuv420p",
+                "-c:a", "aac", "-b:a", "128k",
+            ]
+        else:
+            # Los segmentos ya vienen en H.264: remux sin transcodificar
+            codec = ["-c", "copy", "-avoid_negative_ts", "make_zero"]
+        cmd = [
+            FFMPEG, "-hide_banner", "-loglevel", "error",
+            "-ss", str(start_s), "-i", str(src),
+            "-t", str(dur_s),
+            "-map", "0",
+            *codec,
+            "-f", "hls",
+            "-hls_time", str(HLS_SEC),
+            "-hls_playlist_type", "event",
+            "-hls_flags", "independent_segments+program_date_time",
+            "-hls_segment_filename", seg_pat,
+            str(m3u8_path)
+        ]
+        rc = await run_ffmpeg(cmd)
+        if rc != 0 or not m3u8_path.exists():
+            shutil.rmtree(out_dir, ignore_errors=True)
+            raise HTTPException(500, "FFmpeg no pudo generar HLS del archivo.")
+
+    return m3u8_path
+
+# Template del player como literal de módulo: dos str.replace (nivel C)
+# por request en vez de recorrer un f-string de ~2 KB cada vez.
+_PLAYER_TMPL = """<!doctype html>
+<html lang="es">
+<head>
+<meta charset="utf-8">
+<title>$TITLE</title>
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<style>
+body { margin:0; background:#0b0b0b; color:#fff; font-family:ui-sans-serif,system-ui; }
+.header { padding:10px 14px; background:#111; border-bottom:1px solid #222; }
+main { padding: 10px; }
+video { width: 100%; max-width: 1080px; height: auto; background:#000; outline:none; border:1px solid #222; border-radius:8px; }
+small { color:#aaa; }
+</style>
+</head>
+<body>
+  <div class="header">
+    <div><b>$TITLE</b></div>
+    <small>Si no reproduce, intenta abrir en Edge o Safari, o verifica acceso a <code>hls.js</code>.</small>
+  </div>
+  <main>
+    <video id="v" controls autoplay playsinline></video>
+  </main>
+<script>
+(function() {
+  var video = document.getElementById('v');
+  var src = "$URL";
+  function native() {
+    if (video.canPlayType('application/vnd.apple.mpegurl')) {
+      video.src = src;
+      video.play().catch(()=>{});
+      return true;
+    }
+    return false;
+  }
+  if (!native()) {
+    var s = document.createElement('script');
+    s.src = 'https://cdn.jsdelivr.net/npm/hls.js@latest';
+    s.onload = function() {
+      if (window.Hls) {
+        var hls = new Hls({lowLatencyMode:false});
+        hls.loadSource(src);
+        hls.attachMedia(video);
+        hls.on(Hls.Events.MANIFEST_PARSED, function() {
+          video.play().catch(()=>{});
+        });
+      }
+    };
+    document.head.appendChild(s);
+  }
+})();
+</script>
+</body>
+</html>
+"""
+
+def html_player(hls_url: str, title: str = "QC ALT Player") -> str:
+    # html.escape cierra el XSS que tenía el f-string original
+    return _PLAYER_TMPL.replace("$TITLE", html.escape(title)).replace(
+        "$URL", html.escape(hls_url, quote=True))
+
+@app.get("/view", response_class=HTMLResponse)
+async def view(
+    machine: str = Query(..., description="Machine_ID"),
+    ts: str = Query(..., description="Timestamp ISO, ej. 2025-08-01T13:16:14"),
+    dur: int = Query(30, ge=5, le=600, description="Duración en segundos (5-600)"),
+    accurate: bool = Query(False, description="Re-encode para corte exacto (más CPU)")
+):
+    dt = parse_iso_ts(ts)
+    cam = camera_for_machine(machine)
+    if not cam:
+        raise HTTPException(404, f"No hay cámara mapeada para Machine_ID={machine}")
+
+    src = build_video_path(cam, dt)
+    anchor, start_s = calc_anchor_and_offset(dt)
+
+    # session_id determinista: mismos (cámara, anchor, offset, dur) => misma
+    # carpeta HLS, así un refresh u otro usuario reutilizan el transcode.
+    # La disponibilidad de la fuente también entra a la clave: un HLS simulado
+    # generado cuando faltaba el archivo no debe seguir sirviéndose después de
+    # que aparece el footage real.
+    has_src = segment_exists(src)
+    session_key = f"{cam}|{anchor.isoformat()}|{start_s}|{dur}|{int(accurate)}|{int(has_src)}"
+    session_id = hashlib.blake2b(session_key.encode(), digest_size=8).hexdigest()
+    out_dir = TEMP_DIR / "hls" / session_id
+    m3u8 = out_dir / "master.m3u8"
+
+    if m3u8.exists():
+        # Hit: renueva mtime (fallback del cleanup tras un reinicio)
+        os.utime(out_dir, None)
+    else:
+        # Lock por sesión: dos misses idénticos concurrentes no deben lanzar
+        # dos FFmpeg escribiendo los mismos segmentos en la misma carpeta.
+        lock = _HLS_LOCKS.setdefault(session_id, asyncio.Lock())
+        try:
+            async with lock:
+                if not m3u8.exists():
+                    ensure_dir(out_dir)
+                    m3u8 = await gen_hls_from_source(src if has_src else None, start_s, dur, out_dir, accurate=accurate)
+        finally:
+            # también cuando la generación falla: sin esto cada clave fallida
+            # dejaría su lock huérfano en el dict
+            if not lock.locked():
+                _HLS_LOCKS.pop(session_id, None)
+    touch_session(session_id)
+
+    rel = m3u8.relative_to(TEMP_DIR).as_posix()  # e.g. hls/abc/master.m3u8
+    hls_url = f"/temp/{rel}"
+    title = f"QC ALT — {machine} @ {dt.strftime('%Y-%m-%d %H:%M:%S')}"
+    return HTMLResponse(content=html_player(hls_url, title=title))
+
+# -------------------------
+# Snapshot (preview) y export
+# -------------------------
+
+async def gen_snapshot(src: Optional[Path], at_s: int, out_path: Path):
+    ensure_dir(out_path.parent)
+    if SIMULATE and src is None:
+        if not HAS_FFMPEG:
+            raise HTTPException(500, "Se requiere FFmpeg para generar snapshot simulado.")
+        cmd = [
+            FFMPEG, "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", "testsrc=size=1280x720:rate=1",
+            "-frames:v", "1", str(out_path)
+        ]
+        rc = await run_ffmpeg(cmd)
+        if rc != 0 or not out_path.exists():
+            raise HTTPException(500, "No se pudo generar snapshot simulado.")
+        return
+
+    if not HAS_FFMPEG:
+        raise HTTPException(500, "FFmpeg no encontrado (ver config.json).")
+    if src is None:
+        raise HTTPException(404, "Archivo de video no encontrado.")
+
+    cmd = [
+        FFMPEG, "-hide_banner", "-loglevel", "error",
+        "-ss", str(at_s), "-i", str(src),
+        "-frames:v", "1",
+        "-q:v", "2",
+        str(out_path)
+    ]
+    rc = await run_ffmpeg(cmd)
+    if rc != 0 or not out_path.exists():
+        raise HTTPException(500, "FFmpeg no pudo generar snapshot.")
+
+@app.get("/snapshot")
+async def snapshot(machine: str, ts: str, if_none_match: Optional[str] = Header(None)):
+    dt = parse_iso_ts(ts)
+    cam = camera_for_machine(machine)
+    if not cam:
+        raise HTTPException(404, f"No hay cámara para Machine_ID={machine}")
+    src = build_video_path(cam, dt)
+    anchor, at_s = calc_anchor_and_offset(dt)
+
+    # El nombre es determinista por (machine, ts): si el JPEG ya existe,
+    # no hay que relanzar FFmpeg. La disponibilidad de la fuente entra al
+    # nombre (igual que en /view): un snapshot simulado no debe seguir
+    # sirviéndose una vez que aparece el footage real.
+    has_src = segment_exists(src)
+    suffix = "" if has_src else "_sim"
+    out = TEMP_DIR / "snap" / f"{machine}_{format_compact(dt)}{suffix}.jpg"
+    if not out.exists():
+        await gen_snapshot(src if has_src else None, at_s, out)
+    st = out.stat()
+    etag = hashlib.md5(f"{out}{st.st_mtime}".encode()).hexdigest()
+    if if_none_match == etag:
+        return Response(status_code=304)
+    # stat_result evita que FileResponse repita el stat antes de sendfile
+    return FileResponse(
+        str(out), media_type="image/jpeg", filename=out.name,
+        stat_result=st, headers={"ETag": etag}
+    )
+
+@app.get("/export/snapshot")
+async def export_snapshot(machine: str, ts: str):
+    dt = parse_iso_ts(ts)
+    cam = camera_for_machine(machine)
+    if not cam:
+        raise HTTPException(404, f"No hay cámara para Machine_ID={machine}")
+    src = build_video_path(cam, dt)
+    anchor, at_s = calc_anchor_and_offset(dt)
+    out = EVID_DIR / "snapshots" / f"{machine}_{format_compact(dt)}.jpg"
+    await gen_snapshot(src if segment_exists(src) else None, at_s, out)
+    return ORJSONResponse({"ok": True, "file": str(out)})
+
+async def export_clip_ffmpeg(src: Optional[Path], start_s: int, dur_s: int, out_path: Path, accurate: bool = False):
+    ensure_dir(out_path.parent)
+    if SIMULATE and src is None:
+        if not HAS_FFMPEG:
+            raise HTTPException(500, "Se requiere FFmpeg para exportar clip simulado.")
+        cmd = [
+            FFMPEG, "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", "testsrc=size=1280x720:rate=30",
+            "-f", "lavfi", "-i", "sine=frequency=1000:sample_rate=44100",
+            "-t", str(dur_s),
+            "-map", "0:v:0", "-map", "1:a:0",
+            "-c:v", "libx264", "-preset", "veryfast", "-profile:v", "baseline", "-level", "3.0",
+            "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-b:a", "128k",
+            str(out_path)
+        ]
+        rc = await run_ffmpeg(cmd)
+        if rc != 0 or not out_path.exists():
+            raise HTTPException(500, "No se pudo exportar clip simulado.")
+        return
+
+    if not HAS_FFMPEG:
+        raise HTTPException(500, "FFmpeg no encontrado (ver config.json).")
+    if src is None:
+        raise HTTPException(404, "Archivo de video no encontrado.")
+
+    if accurate:
+        codec = [
+            "-c:v", "libx264", "-preset", "veryfast", "-profile:v", "baseline", "-level", "3.0",
+            "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-b:a", "128k",
+        ]
+    else:
+        codec = ["-c", "copy", "-avoid_negative_ts", "make_zero"]
+    cmd = [
+        FFMPEG, "-hide_banner", "-loglevel", "error",
+        "-ss", str(start_s), "-i", str(src),
+        "-t", str(dur_s),
+        "-map", "0",
+        *codec,
+        str(out_path)
+    ]
+    rc = await run_ffmpeg(cmd)
+    if rc != 0 or not out_path.exists():
+        raise HTTPException(500, "FFmpeg no pudo exportar el clip.")
+
+@app.get("/export/clip")
+async def export_clip(machine: str, ts: str, dur: int = 30, accurate: bool = False):
+    dt = parse_iso_ts(ts)
+    cam = camera_for_machine(machine)
+    if not cam:
+        raise HTTPException(404, f"No hay cámara para Machine_ID={machine}")
+    src = build_video_path(cam, dt)
+    anchor, start_s = calc_anchor_and_offset(dt)
+
+    out = EVID_DIR / "clips" / f"{machine}_{format_compact(dt)}_{dur}s.mp4"
+    await export_clip_ffmpeg(src if segment_exists(src) else None, start_s, dur, out, accurate=accurate)
+    return ORJSONResponse({"ok": True, "file": str(out)})
+
+# -------------------------
+# Página raíz simple
+# -------------------------
+
+@app.get("/", response_class=HTMLResponse)
+def home():
+    return """<!doctype html>
+<html lang="es"><meta charset="utf-8">
+<title>QC ALT</title>
+<body style="font-family:ui-sans-serif; padding:20px">
+<h2>QC ALT — Gateway de Video</h2>
+<ul>
+  <li><a href="/docs">/docs</a> (Swagger)</li>
+  <li><a href="/health">/health</a></li>
+  <li>Ejemplo /view: <code>/view?machine=P703_L1&ts=2025-08-01T13:16:14&dur=30</code></li>
+  <li>Ejemplo /snapshot: <code>/snapshot?machine=P703_L1&ts=2025-08-01T13:16:14</code></li>
+  <li>Ejemplo /export/clip: <code>/export/clip?machine=P703_L1&ts=2025-08-01T13:16:14&dur=30</code></li>
+</ul>
+</body></html>"""
+# =========================
+# Fin del archivo
+# =========================
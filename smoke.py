@@ -1,6 +1,6 @@
-from fastapi import FastAPI
-app = FastAPI()
-
-@app.get("/health")
-def health():
-    return {"ok": True}
+from fastapi import FastAPI
+app = FastAPI()
+
+@app.get("/health")
+def health():
+    return {"ok": True}